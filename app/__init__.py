@@ -0,0 +1,7 @@
+import os
+
+# Pin native thread pools before numpy/cv2 are imported: ONNX Runtime sizes its own intra-op pool,
+# so BLAS stays single-threaded instead of oversubscribing the same cores
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count() or 1))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
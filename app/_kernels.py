@@ -0,0 +1,49 @@
+import numpy as np
+from numba import njit, prange
+
+
+# Full fastmath implies ninf/nnan, which would make the -inf sentinel below undefined behaviour;
+# keep only the flags that let the dot product reassociate and vectorize
+FASTMATH_FLAGS = {"reassoc", "contract", "arcp", "nsz"}
+
+
+@njit(cache=True, fastmath=FASTMATH_FLAGS, parallel=True)
+def cosine_topk(E, q, out_idx, out_score):
+    # Dot every row of E with q (cosine similarity for normalized rows) and keep the best k in descending order
+    n = E.shape[0]
+    d = E.shape[1]
+    scores = np.empty(n, dtype=np.float64)
+    for i in prange(n):
+        s = 0.0
+        for j in range(d):
+            s += E[i, j] * q[j]
+        scores[i] = s
+    k = out_idx.shape[0]
+    for t in range(k):
+        out_idx[t] = -1
+        out_score[t] = -np.inf
+    for i in range(n):
+        s = scores[i]
+        if s <= out_score[k - 1]:
+            continue
+        pos = k - 1
+        while pos > 0 and out_score[pos - 1] < s:
+            out_score[pos] = out_score[pos - 1]
+            out_idx[pos] = out_idx[pos - 1]
+            pos -= 1
+        out_score[pos] = s
+        out_idx[pos] = i
+
+
+def warmup(dim: int = 512, dtype=np.float32) -> None:
+    # Trigger compilation (or load the on-disk cache) for the given dtype before the first request needs it.
+    # A matrix loaded with mmap_mode="r" is a distinct read-only signature to numba, so compile both variants.
+    for writable in (True, False):
+        E = np.zeros((1, dim), dtype=dtype)
+        E.setflags(write=writable)
+        cosine_topk(
+            E,
+            np.zeros(dim, dtype=dtype),
+            np.empty(1, dtype=np.int64),
+            np.empty(1, dtype=np.float64),
+        )
@@ -1,22 +1,32 @@
 from io import BytesIO
 from typing import List, Optional, Tuple
 from pathlib import Path
-from datetime import datetime
+import os
 import re
+import time
 
 import numpy as np
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
 import cv2
+import onnxruntime as ort
 
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.model_zoo import model_zoo
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.utils import face_align
 
 from .storage import FaceStorage
 
 
+cv2.setNumThreads(1)  # leave the cores to ONNX Runtime
+
+
 app = FastAPI(title="Face Recognition App", version="1.0")
 app.add_middleware(
     CORSMiddleware,
@@ -34,13 +44,65 @@ app.mount("/data", StaticFiles(directory="data"), name="data")
 face_analyzer: Optional[FaceAnalysis] = None
 storage = FaceStorage()
 
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Detection runs at 640x640, so larger inputs only cost pre-processing bandwidth
+MAX_IMAGE_SIDE = 1280
+
+
+def build_session_options() -> ort.SessionOptions:
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.intra_op_num_threads = os.cpu_count() or 1
+    opts.inter_op_num_threads = 1
+    opts.enable_cpu_mem_arena = True
+    opts.add_session_config_entry("session.intra_op.allow_spinning", "1")
+    return opts
+
+
+_router_get_model = model_zoo.ModelRouter.get_model
+
+
+def _router_get_model_with_options(self: model_zoo.ModelRouter, **kwargs):
+    # insightface only forwards providers to the InferenceSession; inject tuned options for every sub-model
+    kwargs.setdefault("sess_options", build_session_options())
+    return _router_get_model(self, **kwargs)
+
+
+model_zoo.ModelRouter.get_model = _router_get_model_with_options
+
+
+INSIGHTFACE_ROOT = os.path.expanduser(os.environ.get("INSIGHTFACE_ROOT", "~/.insightface"))
+
+
+def resolve_model_pack() -> str:
+    # Prefer the INT8 recognition pack built by scripts/quantize_arcface.py, but only if it is complete
+    if (Path(INSIGHTFACE_ROOT) / "models" / "buffalo_l_int8" / "w600k_r50.int8.onnx").is_file():
+        return "buffalo_l_int8"
+    return "buffalo_l"
+
 
 @app.on_event("startup")
 def on_startup() -> None:
     global face_analyzer
-    face_analyzer = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])  # CPU by default
+    face_analyzer = FaceAnalysis(
+        name=resolve_model_pack(), root=INSIGHTFACE_ROOT, providers=["CPUExecutionProvider"]
+    )  # CPU by default
     # Larger det_size increases detection accuracy at the cost of speed
     face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+    warmup_face_analyzer()
+    storage.warmup()
+
+
+def warmup_face_analyzer() -> None:
+    # The first inference initializes ORT kernels; pay for it at startup instead of on the first request
+    detect_faces(np.zeros((640, 640, 3), dtype=np.uint8))
+    recognition = face_analyzer.models.get("recognition")
+    if recognition is not None:
+        # A blank frame has no faces, so run the recognition model on a dummy aligned crop too
+        size = recognition.input_size[0]
+        recognition.get_feat([np.zeros((size, size, 3), dtype=np.uint8)])
 
 
 @app.get("/")
@@ -56,17 +118,83 @@ def identities_page() -> FileResponse:
     return FileResponse("static/identities.html")
 
 
+async def read_upload(upload: UploadFile) -> bytes:
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    buffer = BytesIO()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Image too large")
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def limit_image_size(bgr_image: np.ndarray, max_side: int = MAX_IMAGE_SIDE) -> np.ndarray:
+    h, w = bgr_image.shape[:2]
+    longest = max(h, w)
+    if longest <= max_side:
+        return bgr_image
+    scale = max_side / longest
+    return cv2.resize(bgr_image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
 def load_image_as_bgr(image_bytes: bytes) -> np.ndarray:
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    if not image_bytes:
+        raise ValueError("Empty image")
+    # OpenCV decodes straight to BGR; PIL is only needed for formats it cannot read
+    bgr = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr is not None:
+        return limit_image_size(bgr)
+    try:
+        image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    except Exception:
+        raise ValueError("Invalid image")
     rgb = np.array(image)
     bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
-    return bgr
+    return limit_image_size(bgr)
 
 
-def extract_primary_embedding(bgr_image: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+def _arcface_get_batch(self: ArcFaceONNX, img: np.ndarray, faces: List[Face]) -> None:
+    # Align every face and run the recognition model once on a (K, 3, 112, 112) batch
+    if not faces:
+        return
+    aimgs = [face_align.norm_crop(img, landmark=f.kps, image_size=self.input_size[0]) for f in faces]
+    feats = self.get_feat(aimgs)
+    for f, feat in zip(faces, feats):
+        f.embedding = feat.flatten()
+
+
+if not hasattr(ArcFaceONNX, "get_batch"):
+    ArcFaceONNX.get_batch = _arcface_get_batch
+
+
+def detect_faces(bgr_image: np.ndarray) -> List[Face]:
+    # Mirrors FaceAnalysis.get, but models exposing get_batch process all faces in one call
     if face_analyzer is None:
         raise RuntimeError("Face analyzer not initialized")
-    faces = face_analyzer.get(bgr_image)
+    bboxes, kpss = face_analyzer.det_model.detect(bgr_image, max_num=0, metric="default")
+    if bboxes.shape[0] == 0:
+        return []
+    faces: List[Face] = []
+    for i in range(bboxes.shape[0]):
+        kps = kpss[i] if kpss is not None else None
+        faces.append(Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4]))
+    for taskname, model in face_analyzer.models.items():
+        if taskname == "detection":
+            continue
+        if hasattr(model, "get_batch"):
+            model.get_batch(bgr_image, faces)
+        else:
+            for f in faces:
+                model.get(bgr_image, f)
+    return faces
+
+
+def extract_primary_embedding(bgr_image: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+    faces = detect_faces(bgr_image)
     if not faces:
         raise ValueError("No face detected")
     # Choose the largest face by bbox area
@@ -86,9 +214,7 @@ def extract_primary_embedding(bgr_image: np.ndarray) -> Tuple[np.ndarray, List[i
 
 
 def extract_all_embeddings(bgr_image: np.ndarray) -> List[Tuple[np.ndarray, List[int]]]:
-    if face_analyzer is None:
-        raise RuntimeError("Face analyzer not initialized")
-    faces = face_analyzer.get(bgr_image)
+    faces = detect_faces(bgr_image)
     results: List[Tuple[np.ndarray, List[int]]] = []
     h, w = bgr_image.shape[:2]
     for f in faces:
@@ -104,13 +230,52 @@ def extract_all_embeddings(bgr_image: np.ndarray) -> List[Tuple[np.ndarray, List
     return results
 
 
+def file_timestamp(ns: int) -> str:
+    # Same layout as strftime("%Y%m%d_%H%M%S_%f") without the strftime/locale overhead
+    t = time.gmtime(ns // 1_000_000_000)
+    micros = (ns // 1_000) % 1_000_000
+    return (
+        f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}_"
+        f"{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}_{micros:06d}"
+    )
+
+
+def iso_timestamp(ns: int) -> str:
+    t = time.gmtime(ns // 1_000_000_000)
+    micros = (ns // 1_000) % 1_000_000
+    return (
+        f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T"
+        f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}.{micros:06d}Z"
+    )
+
+
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9_\-]")
+
+
 def _sanitize_identity(name: str) -> str:
-    safe = re.sub(r"[^A-Za-z0-9_\-]", "_", name).strip("_-")
+    safe = _SANITIZE_RE.sub("_", name).strip("_-")
     return safe or "unknown"
 
 
+JPEG_QUALITY = 85
+
+
+def write_jpeg(bgr_image: np.ndarray, file_path: Path) -> None:
+    # Runs as a background task, after the response has been sent
+    try:
+        ok, encoded = cv2.imencode(".jpg", bgr_image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if ok:
+            file_path.write_bytes(encoded.tobytes())
+    except Exception:
+        pass
+
+
 def save_face_crop(
-    bgr_image: np.ndarray, bbox: List[int], identity_name: str, ts: Optional[str] = None
+    bgr_image: np.ndarray,
+    bbox: List[int],
+    identity_name: str,
+    background_tasks: BackgroundTasks,
+    ts: Optional[str] = None,
 ) -> Optional[str]:
     try:
         x1, y1, x2, y2 = bbox
@@ -129,10 +294,10 @@ def save_face_crop(
         folder = Path("data") / "recognized" / safe_name
         folder.mkdir(parents=True, exist_ok=True)
         if ts is None:
-            ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+            ts = file_timestamp(time.time_ns())
         file_path = folder / f"{ts}.jpg"
-        # Save using OpenCV (expects BGR)
-        cv2.imwrite(str(file_path), crop)
+        # Encoded and written off the request path; the file name is already known
+        background_tasks.add_task(write_jpeg, crop, file_path)
         # Return URL path that maps via /data mount
         url = f"/data/recognized/{safe_name}/{file_path.name}"
         return url
@@ -140,9 +305,8 @@ def save_face_crop(
         return None
 
 
-def save_annotated_full_image(
-    bgr_image: np.ndarray, bbox: List[int], identity_name: str, category: str = "registered"
-) -> Optional[str]:
+def write_annotated_jpeg(bgr_image: np.ndarray, bbox: List[int], identity_name: str, file_path: Path) -> None:
+    # The full-frame copy only happens here, in the background task, never on the request path
     try:
         x1, y1, x2, y2 = bbox
         # Draw rectangle
@@ -165,13 +329,25 @@ def save_annotated_full_image(
             thickness=-1,
         )
         cv2.putText(annotated, label, (tx + 5, ty + text_h + 2), font, scale, (226, 232, 240), text_thickness)
+    except Exception:
+        return
+    write_jpeg(annotated, file_path)
 
+
+def save_annotated_full_image(
+    bgr_image: np.ndarray,
+    bbox: List[int],
+    identity_name: str,
+    background_tasks: BackgroundTasks,
+    category: str = "registered",
+) -> Optional[str]:
+    try:
         safe_name = _sanitize_identity(identity_name)
         folder = Path("data") / category / safe_name
         folder.mkdir(parents=True, exist_ok=True)
-        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        ts = file_timestamp(time.time_ns())
         file_path = folder / f"{ts}.jpg"
-        cv2.imwrite(str(file_path), annotated)
+        background_tasks.add_task(write_annotated_jpeg, bgr_image, bbox, identity_name, file_path)
         return f"/data/{category}/{safe_name}/{file_path.name}"
     except Exception:
         return None
@@ -179,21 +355,25 @@ def save_annotated_full_image(
 
 @app.post("/api/register")
 async def register_face(
+    background_tasks: BackgroundTasks,
     name: str = Form(...),
     image: UploadFile = File(...),
     personnel_id: Optional[str] = Form(None),
 ) -> JSONResponse:
     if not name or not name.strip():
         raise HTTPException(status_code=400, detail="Name is required")
-    content = await image.read()
+    content = await read_upload(image)
     try:
-        bgr = load_image_as_bgr(content)
-        emb, bbox = extract_primary_embedding(bgr)
+        # Decoding and ONNX inference block, so keep them off the event loop
+        bgr = await run_in_threadpool(load_image_as_bgr, content)
+        emb, bbox = await run_in_threadpool(extract_primary_embedding, bgr)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     pid = (personnel_id or "").strip() or None
     storage.add_face(name.strip(), emb, personnel_id=pid)
-    annotated_url = save_annotated_full_image(bgr, bbox, name.strip(), category="registered")
+    annotated_url = save_annotated_full_image(
+        bgr, bbox, name.strip(), background_tasks, category="registered"
+    )
     return JSONResponse({
         "ok": True,
         "name": name.strip(),
@@ -204,11 +384,15 @@ async def register_face(
 
 
 @app.post("/api/recognize")
-async def recognize_face(image: UploadFile = File(...), threshold: float = Form(0.35)) -> JSONResponse:
-    content = await image.read()
+async def recognize_face(
+    background_tasks: BackgroundTasks,
+    image: UploadFile = File(...),
+    threshold: float = Form(0.35),
+) -> JSONResponse:
+    content = await read_upload(image)
     try:
-        bgr = load_image_as_bgr(content)
-        detections = extract_all_embeddings(bgr)
+        bgr = await run_in_threadpool(load_image_as_bgr, content)
+        detections = await run_in_threadpool(extract_all_embeddings, bgr)
     except ValueError:
         return JSONResponse({"ok": True, "recognized": False, "results": []})
     results = []
@@ -228,9 +412,9 @@ async def recognize_face(image: UploadFile = File(...), threshold: float = Form(
             })
             continue
         name, personnel_id, score = match
-        ts_dt = datetime.utcnow()
-        ts_str = ts_dt.strftime("%Y%m%d_%H%M%S_%f")
-        face_url = save_face_crop(bgr, bbox, name, ts=ts_str)
+        ts_ns = time.time_ns()
+        ts_str = file_timestamp(ts_ns)
+        face_url = save_face_crop(bgr, bbox, name, background_tasks, ts=ts_str)
         any_recognized = True
         results.append({
             "name": name,
@@ -239,7 +423,7 @@ async def recognize_face(image: UploadFile = File(...), threshold: float = Form(
             "bbox": bbox,
             "image_size": [w, h],
             "face_image_url": face_url,
-            "recognized_at": ts_dt.isoformat() + "Z",
+            "recognized_at": iso_timestamp(ts_ns),
             "recognized": True,
         })
     return JSONResponse({
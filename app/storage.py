@@ -1,43 +1,255 @@
+import base64
 import json
+import math
+import os
+from collections import Counter
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 
+try:
+    import faiss
+except ImportError:  # optional: plain NumPy search is used without it
+    faiss = None
+
+try:
+    from . import _kernels
+except ImportError:  # optional: numba-compiled scan used when FAISS is not installed
+    _kernels = None
+
+# Embeddings are L2-normalized (components in [-1, 1]), so one shared scale maps them onto int8 codes
+QUANT_SCALE = 127.0
+
+
+def _quantize(embeddings: np.ndarray) -> np.ndarray:
+    scaled = np.rint(np.asarray(embeddings, dtype=np.float32) * QUANT_SCALE)
+    return np.clip(scaled, -127, 127).astype(np.int8)
+
+
+def _dequantize(codes: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) / QUANT_SCALE
+
+
+def _atomic_write(path: Path, write: Callable[[BinaryIO], None]) -> None:
+    # Write to a temp file, fsync, then rename over the target so readers never see a torn file
+    tmp_path = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    with os.fdopen(fd, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 
 class FaceStorage:
-    def __init__(self, data_dir: str = "data", db_filename: str = "faces.json") -> None:
+    # Structure-of-arrays layout: row i of the int8 embedding matrix belongs to _names[i] / _pids[i]
+    def __init__(
+        self,
+        data_dir: str = "data",
+        meta_filename: str = "meta.json",
+        embeddings_filename: str = "embeddings.npy",
+        legacy_db_filename: str = "faces.json",
+        journal_filename: str = "faces.jsonl",
+        min_compact_rows: int = 64,
+    ) -> None:
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
-        self.db_path = self.data_dir / db_filename
-        if not self.db_path.exists():
-            self._write_db({"faces": []})
-        self._db = self._read_db()
+        self.meta_path = self.data_dir / meta_filename
+        # Snapshots write embeddings-<generation>.npy; meta.json names the file that belongs to it.
+        # This path is the un-numbered file used before generations existed, until meta.json says otherwise
+        self.embeddings_path = self.data_dir / embeddings_filename
+        self._embeddings_stem = self.embeddings_path.stem
+        self._embeddings_suffix = self.embeddings_path.suffix
+        self.legacy_db_path = self.data_dir / legacy_db_filename
+        # Inserts are appended to the journal and folded into the snapshot (meta + embeddings) on compaction
+        self.journal_path = self.data_dir / journal_filename
+        self.min_compact_rows = min_compact_rows
+        self._generation: int = 0
+        self._snapshot_count: int = 0
+        self._names: List[str] = []
+        self._pids: List[Optional[str]] = []
+        # Rows [0, _count) are live; the remainder is spare capacity for appends
+        self._E: np.ndarray = np.empty((0, 0), dtype=np.int8)
+        self._count: int = 0
+        self._index = None
+        if not self.meta_path.exists():
+            self._migrate_legacy_db()
+        self.reload()
+
+    @property
+    def _matrix(self) -> np.ndarray:
+        return self._E[: self._count]
+
+    def _set_matrix(self, matrix: np.ndarray) -> None:
+        self._E = matrix
+        self._count = matrix.shape[0]
+
+    def _migrate_legacy_db(self) -> None:
+        # One-off import of the old faces.json (embeddings stored as JSON floats)
+        faces: List[Dict] = []
+        if self.legacy_db_path.exists():
+            try:
+                with self.legacy_db_path.open("r", encoding="utf-8") as f:
+                    faces = json.load(f).get("faces", [])
+            except Exception:
+                faces = []
+        self._names = [rec.get("name") for rec in faces]
+        self._pids = [rec.get("personnel_id") for rec in faces]
+        if faces:
+            self._set_matrix(_quantize([rec["embedding"] for rec in faces]))
+        else:
+            self._set_matrix(np.empty((0, 0), dtype=np.int8))
+        self._write_snapshot()
+
+    def _read_meta(self) -> Tuple[int, List[Dict], Optional[str]]:
+        try:
+            with self.meta_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            return int(data.get("generation", 0)), data.get("faces", []), data.get("embeddings")
+        except Exception:
+            return 0, [], None
 
-    def _read_db(self) -> Dict:
+    def _write_meta(self) -> None:
+        faces: List[Dict] = []
+        for name, pid in zip(self._names, self._pids):
+            record: Dict = {"name": name}
+            if pid:
+                record["personnel_id"] = pid
+            faces.append(record)
+        payload = json.dumps(
+            {"generation": self._generation, "embeddings": self.embeddings_path.name, "faces": faces}, indent=2
+        ).encode("utf-8")
+        _atomic_write(self.meta_path, lambda f: f.write(payload))
+
+    def _read_embeddings(self) -> np.ndarray:
         try:
-            with self.db_path.open("r", encoding="utf-8") as f:
-                return json.load(f)
+            # Memory-mapped: no parsing and no copy until the matrix is touched
+            return np.load(self.embeddings_path, mmap_mode="r")
         except Exception:
-            return {"faces": []}
+            return np.empty((0, 0), dtype=np.int8)
+
+    def _write_embeddings(self) -> None:
+        matrix = self._matrix
+        _atomic_write(self.embeddings_path, lambda f: np.save(f, matrix))
+
+    def _write_snapshot(self) -> None:
+        if isinstance(self._E, np.memmap):
+            # Detach from the file that is about to be removed
+            self._set_matrix(np.array(self._matrix))
+        # A new generation makes any journal lines left over from before the snapshot stale
+        self._generation += 1
+        self.embeddings_path = self.data_dir / f"{self._embeddings_stem}-{self._generation}{self._embeddings_suffix}"
+        self._write_embeddings()
+        # meta.json is written last and is the commit point: until it is replaced, the previous
+        # meta.json still names the previous embeddings file, which is left untouched
+        self._write_meta()
+        self._snapshot_count = self._count
+        self.journal_path.unlink(missing_ok=True)
+        self._remove_stale_embeddings()
+
+    def _remove_stale_embeddings(self) -> None:
+        legacy = self.data_dir / f"{self._embeddings_stem}{self._embeddings_suffix}"
+        stale = [legacy, *self.data_dir.glob(f"{self._embeddings_stem}-*{self._embeddings_suffix}")]
+        for path in stale:
+            if path != self.embeddings_path:
+                path.unlink(missing_ok=True)
+
+    def _append_journal(self, row: int) -> None:
+        entry: Dict = {"generation": self._generation, "row": row, "name": self._names[row]}
+        if self._pids[row]:
+            entry["personnel_id"] = self._pids[row]
+        entry["codes"] = base64.b64encode(self._E[row].tobytes()).decode("ascii")
+        with self.journal_path.open("ab") as f:
+            f.write(json.dumps(entry).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
 
-    def _write_db(self, data: Dict) -> None:
-        with self.db_path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+    def _replay_journal(self) -> None:
+        if not self.journal_path.exists():
+            return
+        with self.journal_path.open("rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    codes = np.frombuffer(base64.b64decode(entry["codes"]), dtype=np.int8)
+                except Exception:
+                    break  # torn final line from an interrupted append
+                if entry.get("generation") != self._generation or entry.get("row") != self._count:
+                    continue
+                self._append_row(codes)
+                self._names.append(entry.get("name"))
+                self._pids.append(entry.get("personnel_id"))
+
+    def _rebuild_index(self) -> None:
+        if faiss is None or not self._count:
+            self._index = None
+            return
+        if self._index is None or self._index.d != self._E.shape[1]:
+            self._index = self._new_index(self._E.shape[1])
+        self._index.reset()
+        self._index.add(self._matrix.astype(np.float32))
+
+    @staticmethod
+    def _new_index(dim: int):
+        # One byte per dimension holding our int8 codes verbatim, so the stored codes are the only quantization.
+        # FAISS scores 8-bit indexes against an integer-coded query, so best_match passes the query's codes too;
+        # QT_8bit_direct with a +128 offset cannot be corrected per query once the query is coded as well
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit_direct_signed, faiss.METRIC_INNER_PRODUCT)
+
+    def _append_row(self, emb: np.ndarray) -> None:
+        # Capacity doubling keeps appends amortized O(D); a freshly loaded (mmapped) matrix is full
+        if self._count == self._E.shape[0] or not self._count:
+            capacity = max(16, 2 * self._count)
+            grown = np.empty((capacity, emb.shape[0]), dtype=np.int8)
+            if self._count:
+                grown[: self._count] = self._matrix
+            self._E = grown
+        self._E[self._count] = emb
+        self._count += 1
 
     def reload(self) -> None:
-        self._db = self._read_db()
+        self._generation, faces, embeddings_name = self._read_meta()
+        if embeddings_name:
+            self.embeddings_path = self.data_dir / embeddings_name
+        matrix = self._read_embeddings()
+        if matrix.shape[0] != len(faces):
+            # Pairing names with rows by position would attribute faces to the wrong identities
+            raise ValueError(
+                f"{self.meta_path.name} lists {len(faces)} faces but {self.embeddings_path.name} "
+                f"holds {matrix.shape[0]} embeddings"
+            )
+        needs_snapshot = matrix.dtype != np.int8
+        if needs_snapshot:
+            # float32 sidecar written before embeddings were quantized
+            matrix = _quantize(matrix) if matrix.size else np.empty((0, 0), dtype=np.int8)
+        self._names = [rec.get("name") for rec in faces]
+        self._pids = [rec.get("personnel_id") for rec in faces]
+        self._set_matrix(matrix)
+        self._snapshot_count = self._count
+        had_journal = self.journal_path.exists()
+        self._replay_journal()
+        if had_journal or needs_snapshot:
+            # Compact on startup: replayed inserts move into the snapshot and stale or torn lines are dropped,
+            # so later appends never land after a partial line
+            self._write_snapshot()
+        self._rebuild_index()
+
+    def warmup(self) -> None:
+        if faiss is None and _kernels is not None:
+            _kernels.warmup(dtype=np.int8)
 
     def list_faces(self) -> List[Dict]:
-        return list(self._db.get("faces", []))
+        faces: List[Dict] = []
+        for i, (name, pid) in enumerate(zip(self._names, self._pids)):
+            record: Dict = {"name": name, "embedding": _dequantize(self._E[i]).tolist()}
+            if pid:
+                record["personnel_id"] = pid
+            faces.append(record)
+        return faces
 
     def list_identities_summary(self) -> List[Dict]:
-        grouped_counts: Dict[Tuple[str, Optional[str]], int] = {}
-        for rec in self._db.get("faces", []):
-            name = rec.get("name")
-            pid = rec.get("personnel_id")
-            key = (name, pid)
-            grouped_counts[key] = grouped_counts.get(key, 0) + 1
+        grouped_counts = Counter(zip(self._names, self._pids))
         results: List[Dict] = []
         for (name, pid), count in sorted(grouped_counts.items(), key=lambda kv: (kv[0][0] or "", kv[0][1] or "")):
             results.append({"name": name, "personnel_id": pid, "samples": count})
@@ -46,56 +258,84 @@ class FaceStorage:
     def add_face(self, name: str, embedding: np.ndarray, personnel_id: Optional[str] = None) -> None:
         if embedding is None or embedding.size == 0:
             raise ValueError("Empty embedding")
-        norm = np.linalg.norm(embedding)
+        emb = np.array(embedding, dtype=np.float32).ravel()
+        norm = math.sqrt(float(np.vdot(emb, emb)))
         if norm == 0:
             raise ValueError("Zero-norm embedding")
-        normalized = (embedding / norm).astype(float).tolist()
-        record: Dict = {"name": name, "embedding": normalized}
-        if personnel_id:
-            record["personnel_id"] = personnel_id
-        self._db.setdefault("faces", []).append(record)
-        self._write_db(self._db)
+        emb /= norm
+        self._append_row(_quantize(emb))
+        self._names.append(name)
+        self._pids.append(personnel_id or None)
+        journaled = self._count - self._snapshot_count
+        if journaled > max(self.min_compact_rows, 2 * self._snapshot_count):
+            self._write_snapshot()
+        else:
+            self._append_journal(self._count - 1)
+        if self._index is not None and self._index.d == emb.shape[0]:
+            self._index.add(self._E[self._count - 1 : self._count].astype(np.float32))
+        else:
+            self._rebuild_index()
 
     def clear(self) -> None:
-        self._db = {"faces": []}
-        self._write_db(self._db)
+        self._names = []
+        self._pids = []
+        self._set_matrix(np.empty((0, 0), dtype=np.int8))
+        self._write_snapshot()
+        self._rebuild_index()
 
     def best_match(self, embedding: np.ndarray, threshold: float = 0.35) -> Optional[Tuple[str, Optional[str], float]]:
-        if not self._db.get("faces"):
+        if not self._count:
             return None
         # Normalize query embedding
-        norm = np.linalg.norm(embedding)
+        query = np.array(embedding, dtype=np.float32).ravel()
+        norm = math.sqrt(float(np.vdot(query, query)))
         if norm == 0:
             return None
-        query = (embedding / norm).astype(float)
-        best_name: Optional[str] = None
-        best_pid: Optional[str] = None
-        best_score: float = -1.0
-        for rec in self._db.get("faces", []):
-            db_vec = np.array(rec["embedding"], dtype=float)
-            score = float(np.dot(query, db_vec))  # cosine similarity as vectors are normalized
-            if score > best_score:
-                best_score = score
-                best_name = rec["name"]
-                best_pid = rec.get("personnel_id")
-        if best_score >= threshold and best_name is not None:
-            return best_name, best_pid, best_score
+        query /= norm
+        if self._index is not None:
+            scores, indices = self._index.search(_quantize(query).astype(np.float32).reshape(1, -1), 1)
+            best_idx = int(indices[0, 0])
+            best_score = float(scores[0, 0]) / (QUANT_SCALE * QUANT_SCALE)
+        elif _kernels is not None:
+            out_idx = np.empty(1, dtype=np.int64)
+            out_score = np.empty(1, dtype=np.float64)
+            _kernels.cosine_topk(self._matrix, _quantize(query), out_idx, out_score)
+            best_idx = int(out_idx[0])
+            best_score = float(out_score[0]) / (QUANT_SCALE * QUANT_SCALE)
+        else:
+            # Float query against the int8 codes: a float32 matmul (BLAS sgemv), no per-query int32 widening
+            scores = self._matrix @ query
+            best_idx = int(scores.argmax())
+            best_score = float(scores[best_idx]) / QUANT_SCALE
+        # Quantization error can push a self-match slightly past 1.0
+        best_score = min(1.0, max(-1.0, best_score))
+        if best_score >= threshold:
+            return self._names[best_idx], self._pids[best_idx], best_score
         return None
 
+    def _identity_mask(self, name: str, personnel_id: Optional[str]) -> np.ndarray:
+        return np.fromiter(
+            (
+                rec_name == name and (personnel_id is None and rec_pid is None or rec_pid == personnel_id)
+                for rec_name, rec_pid in zip(self._names, self._pids)
+            ),
+            dtype=bool,
+            count=self._count,
+        )
+
     def delete_identity(self, name: str, personnel_id: Optional[str] = None) -> int:
-        original = self._db.get("faces", [])
-        kept: List[Dict] = []
-        removed: int = 0
-        for rec in original:
-            rec_name = rec.get("name")
-            rec_pid = rec.get("personnel_id")
-            if rec_name == name and (personnel_id is None and rec_pid is None or rec_pid == personnel_id):
-                removed += 1
-            else:
-                kept.append(rec)
+        mask = self._identity_mask(name, personnel_id)
+        removed = int(mask.sum())
         if removed > 0:
-            self._db["faces"] = kept
-            self._write_db(self._db)
+            keep = ~mask
+            self._names = [n for n, k in zip(self._names, keep) if k]
+            self._pids = [p for p, k in zip(self._pids, keep) if k]
+            if self._names:
+                self._set_matrix(np.ascontiguousarray(self._matrix[keep]))
+            else:
+                self._set_matrix(np.empty((0, 0), dtype=np.int8))
+            self._write_snapshot()
+            self._rebuild_index()
         return removed
 
     def rename_identity(
@@ -105,19 +345,11 @@ class FaceStorage:
         new_name: str,
         new_personnel_id: Optional[str],
     ) -> int:
-        changed = 0
-        for rec in self._db.get("faces", []):
-            rec_name = rec.get("name")
-            rec_pid = rec.get("personnel_id")
-            if rec_name == old_name and (old_personnel_id is None and rec_pid is None or rec_pid == old_personnel_id):
-                rec["name"] = new_name
-                if new_personnel_id is None:
-                    # remove key if exists
-                    if "personnel_id" in rec:
-                        del rec["personnel_id"]
-                else:
-                    rec["personnel_id"] = new_personnel_id
-                changed += 1
+        mask = self._identity_mask(old_name, old_personnel_id)
+        changed = int(mask.sum())
         if changed:
-            self._write_db(self._db)
+            for i in np.flatnonzero(mask):
+                self._names[i] = new_name
+                self._pids[i] = new_personnel_id
+            self._write_snapshot()
         return changed
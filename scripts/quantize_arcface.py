@@ -0,0 +1,49 @@
+import os
+import shutil
+from pathlib import Path
+
+from insightface.utils.storage import ensure_available
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+
+SOURCE_PACK = "buffalo_l"
+TARGET_PACK = "buffalo_l_int8"
+RECOGNITION_MODEL = "w600k_r50.onnx"
+
+
+def build_int8_pack(root: Path) -> Path:
+    source_dir = Path(ensure_available("models", SOURCE_PACK, root=str(root)))
+    target_dir = root / "models" / TARGET_PACK
+    # Build next to the target and move it into place only once it is complete, so an interrupted run
+    # never leaves a buffalo_l_int8 directory without a recognition model
+    build_dir = root / "models" / f"{TARGET_PACK}.tmp"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+
+    # Detection and the auxiliary models stay FP32; only recognition is quantized
+    for onnx_file in sorted(source_dir.glob("*.onnx")):
+        if onnx_file.name == RECOGNITION_MODEL:
+            continue
+        shutil.copy2(onnx_file, build_dir / onnx_file.name)
+
+    # The pack directory must hold a single recognition model, otherwise FaceAnalysis picks the first one
+    int8_name = RECOGNITION_MODEL.replace(".onnx", ".int8.onnx")
+    quantize_dynamic(
+        model_input=str(source_dir / RECOGNITION_MODEL),
+        model_output=str(build_dir / int8_name),
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        reduce_range=True,
+    )
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(build_dir, target_dir)
+
+    print("Generated:")
+    print(f"  Pack:        {target_dir}")
+    print(f"  Recognition: {target_dir / int8_name}")
+    return target_dir
+
+
+if __name__ == "__main__":
+    build_int8_pack(Path(os.path.expanduser(os.environ.get("INSIGHTFACE_ROOT", "~/.insightface"))))
@@ -0,0 +1,37 @@
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+
+
+def main() -> None:
+    cert_dir = Path("certs")
+    cert_path = cert_dir / "cert.pem"
+    key_path = cert_dir / "key.pem"
+    use_tls = cert_path.exists() and key_path.exists()
+
+    # Every worker process would hold its own FaceStorage and append to the same faces.jsonl: concurrent
+    # registrations write duplicate journal rows that replay then drops, and one worker's compaction deletes
+    # the others' journal lines. That loses registered faces, so only a single worker is supported
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers != 1:
+        raise SystemExit(f"WORKERS={workers} is not supported: FaceStorage is not shared across processes")
+
+    uvicorn.run(
+        "app.main:app",
+        # Run from the repository root: static/, data/ and certs/ are resolved relative to it
+        app_dir=".",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        # uvloop is not available on Windows; httptools is
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=workers,
+        ssl_certfile=str(cert_path) if use_tls else None,
+        ssl_keyfile=str(key_path) if use_tls else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
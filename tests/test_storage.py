@@ -0,0 +1,151 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.storage import FaceStorage
+
+
+NAMES = ["alice", "bob", "carol"]
+
+
+@pytest.fixture
+def embeddings() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(len(NAMES), 512)).astype(np.float32)
+
+
+def _journal_lines(storage: FaceStorage) -> int:
+    if not storage.journal_path.exists():
+        return 0
+    return storage.journal_path.read_bytes().count(b"\n")
+
+
+def test_add_and_match_survive_reload(tmp_path, embeddings):
+    storage = FaceStorage(str(tmp_path))
+    for name, emb in zip(NAMES, embeddings):
+        storage.add_face(name, emb, personnel_id=f"id-{name}")
+
+    reloaded = FaceStorage(str(tmp_path))
+    for name, emb in zip(NAMES, embeddings):
+        match = reloaded.best_match(emb)
+        assert match is not None
+        assert match[:2] == (name, f"id-{name}")
+        assert -1.0 <= match[2] <= 1.0
+
+
+def test_inserts_are_journaled_until_compaction_threshold(tmp_path, embeddings):
+    storage = FaceStorage(str(tmp_path), min_compact_rows=2)
+    storage.add_face("alice", embeddings[0])
+    storage.add_face("bob", embeddings[1])
+    assert _journal_lines(storage) == 2
+
+    # Third insert exceeds max(min_compact_rows, 2 * snapshot rows) and folds the journal into a snapshot
+    storage.add_face("carol", embeddings[2])
+    assert not storage.journal_path.exists()
+    assert FaceStorage(str(tmp_path), min_compact_rows=2).best_match(embeddings[2])[0] == "carol"
+
+
+def test_torn_journal_tail_does_not_swallow_later_inserts(tmp_path, embeddings):
+    storage = FaceStorage(str(tmp_path))
+    storage.add_face("alice", embeddings[0])
+    storage.reload()  # compacts alice into the snapshot
+    with storage.journal_path.open("ab") as f:
+        f.write(b'{"generation": 1, "row": 1, "na')
+
+    storage = FaceStorage(str(tmp_path))
+    storage.add_face("bob", embeddings[1])
+    storage.add_face("carol", embeddings[2])
+
+    reloaded = FaceStorage(str(tmp_path))
+    assert [s["name"] for s in reloaded.list_identities_summary()] == NAMES
+    for name, emb in zip(NAMES, embeddings):
+        assert reloaded.best_match(emb)[0] == name
+
+
+def test_stale_generation_journal_lines_are_ignored(tmp_path, embeddings):
+    storage = FaceStorage(str(tmp_path))
+    storage.add_face("alice", embeddings[0])
+    storage.add_face("bob", embeddings[1])
+    journal = storage.journal_path.read_bytes()
+    # delete_identity writes a new snapshot generation; an old journal left behind by a crash must not come back
+    storage.delete_identity("bob")
+    storage.journal_path.write_bytes(journal)
+
+    reloaded = FaceStorage(str(tmp_path))
+    assert [s["name"] for s in reloaded.list_identities_summary()] == ["alice"]
+    assert not reloaded.journal_path.exists()
+
+
+def test_crash_before_meta_write_keeps_previous_snapshot(tmp_path, embeddings, monkeypatch):
+    storage = FaceStorage(str(tmp_path))
+    for name, emb in zip(NAMES, embeddings):
+        storage.add_face(name, emb)
+    storage.reload()
+
+    def crash() -> None:
+        raise OSError("simulated crash")
+
+    monkeypatch.setattr(storage, "_write_meta", crash)
+    with pytest.raises(OSError):
+        storage.delete_identity("alice")
+
+    reloaded = FaceStorage(str(tmp_path))
+    for name, emb in zip(NAMES, embeddings):
+        assert reloaded.best_match(emb)[0] == name
+
+
+def test_mismatched_sidecars_are_refused(tmp_path, embeddings):
+    storage = FaceStorage(str(tmp_path))
+    storage.add_face("alice", embeddings[0])
+    storage.reload()
+    meta = json.loads(storage.meta_path.read_text(encoding="utf-8"))
+    meta["faces"].append({"name": "bob"})
+    storage.meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        FaceStorage(str(tmp_path))
+
+
+def test_legacy_faces_json_is_imported(tmp_path, embeddings):
+    legacy = {"faces": [{"name": "alice", "personnel_id": "7", "embedding": embeddings[0].tolist()}]}
+    (tmp_path / "faces.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+    storage = FaceStorage(str(tmp_path))
+    assert storage.best_match(embeddings[0])[:2] == ("alice", "7")
+
+
+def test_numpy_scoring_path_without_faiss_or_numba(tmp_path, embeddings, monkeypatch):
+    monkeypatch.setattr("app.storage.faiss", None)
+    monkeypatch.setattr("app.storage._kernels", None)
+    storage = FaceStorage(str(tmp_path))
+    for name, emb in zip(NAMES, embeddings):
+        storage.add_face(name, emb)
+
+    for name, emb in zip(NAMES, embeddings):
+        match = storage.best_match(emb)
+        assert match is not None and match[0] == name
+        assert match[2] == pytest.approx(1.0, abs=1e-2)
+    # Unrelated random vectors in 512-D are near-orthogonal, well under the default threshold
+    other = np.random.default_rng(1).normal(size=512)
+    assert storage.best_match(other) is None
+
+
+def test_faiss_scores_match_numpy_path(tmp_path, embeddings, monkeypatch):
+    pytest.importorskip("faiss")
+    queries = embeddings + np.random.default_rng(2).normal(scale=0.3, size=embeddings.shape)
+    with_faiss = FaceStorage(str(tmp_path / "faiss"))
+    for name, emb in zip(NAMES, embeddings):
+        with_faiss.add_face(name, emb)
+    assert with_faiss._index is not None
+    faiss_matches = [with_faiss.best_match(q, threshold=-1.0) for q in queries]
+
+    with monkeypatch.context() as m:
+        m.setattr("app.storage.faiss", None)
+        m.setattr("app.storage._kernels", None)
+        plain = FaceStorage(str(tmp_path / "faiss"))
+        assert plain._index is None
+        plain_matches = [plain.best_match(q, threshold=-1.0) for q in queries]
+
+    for faiss_match, plain_match in zip(faiss_matches, plain_matches):
+        assert faiss_match[0] == plain_match[0]
+        assert faiss_match[2] == pytest.approx(plain_match[2], abs=2e-2)